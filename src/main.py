@@ -1,13 +1,13 @@
 import argparse
-import json
+import functools
+import itertools
 import logging
 import os
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from services.instagram_client import InstagramClient, InstagramAPIError
-from services.message_sender import MessageSender
-from utils.delay_manager import DelayManager
+from utils import json_codec
 from utils.proxy_handler import build_proxy_dict
 
 logger = logging.getLogger(__name__)
@@ -20,12 +20,11 @@ def setup_logging(level: str = "INFO") -> None:
     )
 
 def load_config(path: Path) -> Dict[str, Any]:
-    if not path.exists():
+    try:
+        return json_codec.loads(path.read_bytes())
+    except FileNotFoundError:
         logger.warning("Config file %s not found, using defaults and CLI/env only.", path)
         return {}
-    try:
-        with path.open("r", encoding="utf-8") as f:
-            return json.load(f)
     except Exception as exc:  # noqa: BLE001
         logger.error("Failed to load config from %s: %s", path, exc)
         return {}
@@ -47,7 +46,18 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--output",
         type=str,
-        help="Path to output JSON file to store results (defaults to data/output.example.json).",
+        help=(
+            "Path to output JSON file to store results (defaults to data/output.example.json). "
+            "Per-target results are streamed to the same path with a .jsonl suffix "
+            "(an extra .jsonl is appended if --output already ends in .jsonl and "
+            "--final-json is set)."
+        ),
+    )
+    parser.add_argument(
+        "--user-id-cache",
+        type=str,
+        dest="user_id_cache",
+        help="Path to JSON cache of resolved username -> user ID (defaults to data/user_id_cache.json).",
     )
     parser.add_argument(
         "--session-id",
@@ -83,6 +93,26 @@ def parse_args() -> argparse.Namespace:
         dest="max_targets",
         help="Maximum number of users to message in this run.",
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="Number of targets processed in parallel, each with its own delay. Default: 1.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        dest="batch_size",
+        help=(
+            "Send one request (and wait one delay) for up to this many consecutive "
+            "targets with the same message; each still gets its own thread. Default: 1."
+        ),
+    )
+    parser.add_argument(
+        "--final-json",
+        action="store_true",
+        dest="final_json",
+        help="Also write all results as a single JSON array to --output at the end of the run.",
+    )
     parser.add_argument(
         "--dry-run",
         action="store_true",
@@ -113,15 +143,142 @@ def get_setting(
         return cfg[cfg_key]
     return default
 
-def load_targets(path: Path) -> List[Dict[str, Any]]:
-    if not path.exists():
-        raise FileNotFoundError(f"Input file not found: {path}")
-    with path.open("r", encoding="utf-8") as f:
-        data = json.load(f)
-    if not isinstance(data, list):
+@dataclass(frozen=True, slots=True)
+class RunConfig:
+    """
+    Fully resolved settings for one run (CLI > env > config file > default).
+    """
+
+    session_id: Optional[str]
+    message_template: str
+    min_delay: float
+    max_delay: float
+    proxy_url: Optional[str]
+    max_targets: Optional[int]
+    concurrency: int
+    batch_size: int
+    input_path: Path
+    output_path: Path
+    user_id_cache_path: Path
+    dry_run: bool
+    final_json: bool
+
+# (field, CLI dest, env var, config key, default, converter applied to non-None values)
+SettingSpec = Tuple[str, str, Optional[str], str, Any, Optional[Callable[[Any], Any]]]
+
+def resolve_run_config(
+    args: argparse.Namespace,
+    cfg: Dict[str, Any],
+    project_root: Path,
+) -> RunConfig:
+    data_dir = project_root / "data"
+    specs: List[SettingSpec] = [
+        ("session_id", "session_id", "IG_SESSION_ID", "session_id", None, None),
+        (
+            "message_template",
+            "message",
+            None,
+            "default_message",
+            "Hello {username}, this is an automated message.",
+            None,
+        ),
+        ("min_delay", "min_delay", None, "min_delay_seconds", 45.0, float),
+        ("max_delay", "max_delay", None, "max_delay_seconds", 60.0, float),
+        ("proxy_url", "proxy", "IG_PROXY_URL", "proxy_url", None, None),
+        ("max_targets", "max_targets", None, "max_targets", None, int),
+        ("concurrency", "concurrency", None, "concurrency", 1, int),
+        ("batch_size", "batch_size", None, "batch_size", 1, int),
+        ("input_path", "input", None, "input_file", data_dir / "input.sample.json", Path),
+        ("output_path", "output", None, "output_file", data_dir / "output.example.json", Path),
+        (
+            "user_id_cache_path",
+            "user_id_cache",
+            None,
+            "user_id_cache_file",
+            data_dir / "user_id_cache.json",
+            Path,
+        ),
+    ]
+    values: Dict[str, Any] = {}
+    for field, cli_dest, env_var, cfg_key, default, convert in specs:
+        value = get_setting(getattr(args, cli_dest), env_var, cfg, cfg_key, default=default)
+        if convert is not None and value is not None:
+            value = convert(value)
+        values[field] = value
+
+    values["dry_run"] = bool(args.dry_run or cfg.get("dry_run", False))
+    values["final_json"] = bool(args.final_json or cfg.get("final_json", False))
+    return RunConfig(**values)
+
+# Input files at least this large are parsed incrementally when ijson is installed.
+STREAMING_INPUT_MIN_BYTES = 1 << 20
+
+TARGETS_SCHEMA: Dict[str, Any] = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "required": ["username"],
+        "properties": {"username": {"type": "string", "minLength": 1}},
+    },
+}
+
+# The optional parsers below are imported on first use rather than at module
+# load, so --help and usage errors don't pay for them.
+
+@functools.lru_cache(maxsize=None)
+def _load_ijson() -> Any:
+    """
+    Return the ijson module, or None when it is not installed.
+    """
+    try:
+        import ijson  # picks the yajl2_c backend automatically when available
+    except ImportError:  # pragma: no cover - optional dependency
+        return None
+    return ijson
+
+@functools.lru_cache(maxsize=None)
+def _targets_validator() -> Optional[Callable[[Any], Any]]:
+    """
+    Compile TARGETS_SCHEMA once; None when fastjsonschema is not installed.
+    """
+    try:
+        import fastjsonschema
+    except ImportError:  # pragma: no cover - optional dependency
+        return None
+    return fastjsonschema.compile(TARGETS_SCHEMA)
+
+def _all_targets_valid(data: List[Any]) -> bool:
+    """
+    True if every entry passes the compiled schema, so per-item checks can be skipped.
+    """
+    validate = _targets_validator()
+    if validate is None:
+        return False
+    import fastjsonschema  # already loaded by _targets_validator
+
+    try:
+        validate(data)
+    except fastjsonschema.JsonSchemaException:
+        return False
+    return True
+
+def _stream_input_items(ijson: Any, f: BinaryIO) -> Iterator[Tuple[int, Any]]:
+    """
+    Yield (index, item) for each entry of the top-level JSON array in f.
+    """
+    events = ijson.parse(f, use_float=True)
+    first = next(events, None)
+    if first is None or first[1] != "start_array":
         raise ValueError("Input JSON must be a list of objects.")
+    yield from enumerate(ijson.items(itertools.chain((first,), events), "item"))
+
+def _collect_valid_targets(
+    items: Iterable[Tuple[int, Any]],
+    limit: Optional[int],
+    path: Path,
+) -> List[Dict[str, Any]]:
     valid_targets: List[Dict[str, Any]] = []
-    for idx, item in enumerate(data):
+    for idx, item in items:
         if not isinstance(item, dict):
             logger.warning("Skipping non-object entry at index %d in input.", idx)
             continue
@@ -130,18 +287,55 @@ def load_targets(path: Path) -> List[Dict[str, Any]]:
             logger.warning("Skipping entry without 'username' at index %d.", idx)
             continue
         valid_targets.append(item)
+        if limit is not None and len(valid_targets) >= limit:
+            break
     if not valid_targets:
         logger.warning("No valid targets found in input file: %s", path)
     return valid_targets
 
+def load_targets(path: Path, max_targets: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Load and validate targets, stopping once max_targets valid entries are found.
+    """
+    limit = max_targets if max_targets is not None and max_targets > 0 else None
+    try:
+        f = path.open("rb")
+    except FileNotFoundError as exc:
+        raise FileNotFoundError(f"Input file not found: {path}") from exc
+
+    with f:
+        if os.fstat(f.fileno()).st_size >= STREAMING_INPUT_MIN_BYTES:
+            ijson = _load_ijson()
+            if ijson is not None:
+                return _collect_valid_targets(_stream_input_items(ijson, f), limit, path)
+        data = json_codec.loads(f.read())
+
+    if not isinstance(data, list):
+        raise ValueError("Input JSON must be a list of objects.")
+    if _all_targets_valid(data):
+        valid_targets: List[Dict[str, Any]] = data[:limit] if limit is not None else data
+        if not valid_targets:
+            logger.warning("No valid targets found in input file: %s", path)
+        return valid_targets
+    # Fall back to per-item checks to report each offending entry.
+    return _collect_valid_targets(enumerate(data), limit, path)
+
 def ensure_parent_dir(path: Path) -> None:
-    if not path.parent.exists():
-        path.parent.mkdir(parents=True, exist_ok=True)
+    # exist_ok already covers the case where the directory is there.
+    path.parent.mkdir(parents=True, exist_ok=True)
 
 def main() -> None:
     args = parse_args()
     setup_logging(args.log_level)
 
+    # Deferred until the arguments are known to be valid, so --help and
+    # usage errors don't pay for importing the sending stack.
+    import asyncio
+
+    from services.exceptions import InstagramAPIError
+    from services.message_sender import MessageSender
+    from utils.delay_manager import DelayManager
+
     script_dir = Path(__file__).resolve().parent
     project_root = script_dir.parent
 
@@ -149,108 +343,75 @@ def main() -> None:
     config_path = Path(args.config) if args.config else default_config_path
 
     cfg = load_config(config_path)
+    run = resolve_run_config(args, cfg, project_root)
 
-    session_id = get_setting(
-        args.session_id,
-        "IG_SESSION_ID",
-        cfg,
-        "session_id",
-        default=None,
-    )
-    if not session_id:
+    if not run.session_id:
         logger.error(
             "Instagram session ID is required. Provide via --session-id, config JSON, or IG_SESSION_ID env variable."
         )
         raise SystemExit(1)
 
-    message_template: str = get_setting(
-        args.message,
-        None,
-        cfg,
-        "default_message",
-        default="Hello {username}, this is an automated message.",
-    )
-
-    min_delay: float = float(
-        get_setting(args.min_delay, None, cfg, "min_delay_seconds", default=45.0)
-    )
-    max_delay: float = float(
-        get_setting(args.max_delay, None, cfg, "max_delay_seconds", default=60.0)
-    )
-
-    if min_delay <= 0 or max_delay <= 0 or max_delay < min_delay:
+    if run.min_delay <= 0 or run.max_delay <= 0 or run.max_delay < run.min_delay:
         logger.error(
             "Invalid delay configuration: min_delay=%.2f, max_delay=%.2f. Ensure both > 0 and max >= min.",
-            min_delay,
-            max_delay,
+            run.min_delay,
+            run.max_delay,
         )
         raise SystemExit(1)
 
-    proxy_url: Optional[str] = get_setting(
-        args.proxy,
-        "IG_PROXY_URL",
-        cfg,
-        "proxy_url",
-        default=None,
-    )
-    proxies = build_proxy_dict(proxy_url) if proxy_url else None
-
-    max_targets: Optional[int] = get_setting(
-        args.max_targets,
-        None,
-        cfg,
-        "max_targets",
-        default=None,
-    )
-    dry_run: bool = bool(args.dry_run or cfg.get("dry_run", False))
-
-    input_path_str = get_setting(
-        args.input,
-        None,
-        cfg,
-        "input_file",
-        default=str(project_root / "data" / "input.sample.json"),
-    )
-    output_path_str = get_setting(
-        args.output,
-        None,
-        cfg,
-        "output_file",
-        default=str(project_root / "data" / "output.example.json"),
-    )
+    if run.concurrency < 1:
+        logger.error("Invalid concurrency: %d. Must be >= 1.", run.concurrency)
+        raise SystemExit(1)
+
+    if run.batch_size < 1:
+        logger.error("Invalid batch size: %d. Must be >= 1.", run.batch_size)
+        raise SystemExit(1)
 
-    input_path = Path(input_path_str)
-    output_path = Path(output_path_str)
+    proxies = build_proxy_dict(run.proxy_url) if run.proxy_url else None
 
     try:
-        targets = load_targets(input_path)
+        targets = load_targets(run.input_path, max_targets=run.max_targets)
     except Exception as exc:  # noqa: BLE001
         logger.error("Failed to load targets: %s", exc)
         raise SystemExit(1)
 
-    if max_targets is not None and max_targets > 0:
-        targets = targets[: max_targets]
-
     if not targets:
         logger.warning("No targets to process. Exiting.")
         return
 
-    delay_manager = DelayManager(min_delay_seconds=min_delay, max_delay_seconds=max_delay)
-    client = InstagramClient(session_id=session_id, proxies=proxies)
+    delay_manager = DelayManager(min_delay_seconds=run.min_delay, max_delay_seconds=run.max_delay)
+
+    client = None
+    if not run.dry_run:
+        # Only real runs need requests and the Instagram client.
+        from services.instagram_client import InstagramClient
+
+        ensure_parent_dir(run.user_id_cache_path)
+        client = InstagramClient(
+            session_id=run.session_id,
+            proxies=proxies,
+            user_id_cache_path=run.user_id_cache_path,
+        )
+        client.warmup()
 
     sender = MessageSender(
         client=client,
         delay_manager=delay_manager,
-        dry_run=dry_run,
+        dry_run=run.dry_run,
+        concurrency=run.concurrency,
+        batch_size=run.batch_size,
     )
 
-    ensure_parent_dir(output_path)
+    ensure_parent_dir(run.output_path)
 
     try:
-        results = sender.send_messages(
-            targets=targets,
-            message_template=message_template,
-            output_path=output_path,
+        results = asyncio.run(
+            sender.send_messages(
+                targets=targets,
+                message_template=run.message_template,
+                output_path=run.output_path,
+                final_json=run.final_json,
+            )
         )
     except InstagramAPIError as api_exc:
         logger.error("Instagram API error during sending: %s", api_exc)
@@ -258,6 +419,8 @@ def main() -> None:
     except Exception as exc:  # noqa: BLE001
         logger.error("Unexpected error during sending: %s", exc)
         raise SystemExit(1)
+    finally:
+        sender.close()
 
     logger.info("Completed sending messages to %d targets.", len(results))
 
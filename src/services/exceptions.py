@@ -0,0 +1,2 @@
+class InstagramAPIError(RuntimeError):
+    """Raised when Instagram API returns an error or unexpected response."""
@@ -1,13 +1,19 @@
 import json
 import logging
-from typing import Any, Dict, Optional
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional
+from urllib.parse import quote_plus
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+from urllib3.util.retry import Retry
 
-logger = logging.getLogger(__name__)
+from services.exceptions import InstagramAPIError
+from utils import json_codec
 
-class InstagramAPIError(RuntimeError):
-    """Raised when Instagram API returns an error or unexpected response."""
+logger = logging.getLogger(__name__)
 
 class InstagramClient:
     """
@@ -19,18 +25,41 @@ class InstagramClient:
 
     BASE_WEB_URL = "https://www.instagram.com"
     BASE_API_URL = "https://www.instagram.com/api/v1"
+    POOL_MAXSIZE = 32
+    # Profile info responses can run to a few hundred KB; anything past this is dropped.
+    DEFAULT_MAX_BODY_BYTES = 1 << 20
+
+    # Static parts of the urlencoded broadcast body; see _encode_dm_body.
+    _DM_BODY_PREFIX = b"action=send_item&recipient_users="
+    _DM_BODY_TEXT = b"&text="
 
     def __init__(
         self,
         session_id: str,
-        proxies: Optional[Dict[str, str]] = None,
+        proxies: Optional[Mapping[str, str]] = None,
         user_agent: Optional[str] = None,
         timeout: float = 30.0,
+        user_id_cache_path: Optional[Path] = None,
+        max_body_bytes: int = DEFAULT_MAX_BODY_BYTES,
     ) -> None:
         if not session_id:
             raise ValueError("session_id must not be empty.")
 
         self.session = requests.Session()
+        # One keep-alive pool for the whole run. Retries only cover idempotent
+        # methods (urllib3's default), so a DM POST is never sent twice.
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.POOL_MAXSIZE,
+            pool_block=True,
+            max_retries=Retry(
+                total=2,
+                backoff_factor=0.2,
+                status_forcelist=(429, 500, 502, 503, 504),
+                raise_on_status=False,
+            ),
+        )
+        self.session.mount("https://", adapter)
         self.session.cookies.set("sessionid", session_id, domain=".instagram.com")
         self.session.headers.update(
             {
@@ -50,6 +79,69 @@ class InstagramClient:
         if proxies:
             self.session.proxies.update(proxies)
         self.timeout = timeout
+        self.max_body_bytes = max_body_bytes
+        self._dm_headers = {"Content-Type": "application/x-www-form-urlencoded"}
+
+        self.user_id_cache_path = user_id_cache_path
+        self._uid_cache: Dict[str, str] = self._load_user_id_cache()
+        self._uid_cache_lock = threading.Lock()
+        self._uid_cache_pending = 0
+
+    def _load_user_id_cache(self) -> Dict[str, str]:
+        if self.user_id_cache_path is None:
+            return {}
+        try:
+            data = json_codec.loads(self.user_id_cache_path.read_bytes())
+        except FileNotFoundError:
+            return {}
+        except Exception as exc:  # noqa: BLE001
+            logger.warning(
+                "Ignoring unreadable user ID cache %s: %s", self.user_id_cache_path, exc
+            )
+            return {}
+        if not isinstance(data, dict):
+            logger.warning("Ignoring user ID cache %s: not a JSON object.", self.user_id_cache_path)
+            return {}
+        logger.debug("Loaded %d cached user IDs from %s.", len(data), self.user_id_cache_path)
+        return {str(k): str(v) for k, v in data.items()}
+
+    @property
+    def pending_user_id_writes(self) -> int:
+        """
+        Number of user IDs resolved since the cache file was last written.
+        """
+        return self._uid_cache_pending
+
+    def flush_user_id_cache(self) -> None:
+        """
+        Persist newly resolved user IDs to user_id_cache_path, if one is set.
+        """
+        if self.user_id_cache_path is None:
+            return
+        with self._uid_cache_lock:
+            if not self._uid_cache_pending:
+                return
+            # Write to a sibling file and swap it in so a crash never leaves a
+            # truncated cache behind.
+            tmp_path = self.user_id_cache_path.with_name(self.user_id_cache_path.name + ".tmp")
+            tmp_path.write_bytes(json_codec.dumps(self._uid_cache))
+            tmp_path.replace(self.user_id_cache_path)
+            self._uid_cache_pending = 0
+        logger.debug("Wrote %d cached user IDs to %s.", len(self._uid_cache), self.user_id_cache_path)
+
+    def warmup(self) -> None:
+        """
+        Open the pooled connection (TCP + TLS) ahead of the first API call.
+
+        Failures are logged and ignored; the first real request will retry.
+        """
+        try:
+            response = self.session.get(self.BASE_WEB_URL, timeout=self.timeout)
+            response.close()
+        except requests.RequestException as exc:
+            logger.warning("Connection warmup to %s failed: %s", self.BASE_WEB_URL, exc)
+            return
+        logger.debug("Warmed up connection to %s.", self.BASE_WEB_URL)
 
     def _request(
         self,
@@ -58,7 +150,6 @@ class InstagramClient:
         *,
         params: Optional[Dict[str, Any]] = None,
         data: Optional[Dict[str, Any]] = None,
-        headers: Optional[Dict[str, str]] = None,
     ) -> requests.Response:
         logger.debug("Requesting %s %s", method, url)
         try:
@@ -67,13 +158,62 @@ class InstagramClient:
                 url=url,
                 params=params,
                 data=data,
-                headers=headers,
                 timeout=self.timeout,
+                stream=True,
+            )
+            self._read_capped(response)
+        except requests.RequestException as exc:
+            logger.error("Network error while calling Instagram: %s", exc)
+            raise InstagramAPIError(f"Network error: {exc}") from exc
+        return self._check_response(response)
+
+    def _post_form(self, url: str, body: bytes) -> requests.Response:
+        """
+        POST an already urlencoded body, skipping requests' form encoding.
+        """
+        logger.debug("Requesting POST %s", url)
+        try:
+            response = self.session.post(
+                url, data=body, headers=self._dm_headers, timeout=self.timeout, stream=True
             )
+            self._read_capped(response)
         except requests.RequestException as exc:
             logger.error("Network error while calling Instagram: %s", exc)
             raise InstagramAPIError(f"Network error: {exc}") from exc
+        return self._check_response(response)
 
+    def _read_capped(self, response: requests.Response) -> None:
+        """
+        Load at most max_body_bytes of a streamed response into response.content.
+        """
+        try:
+            raw = response.raw.read(self.max_body_bytes + 1, decode_content=True)
+        except (Urllib3HTTPError, OSError) as exc:
+            response.close()
+            raise requests.RequestException(f"Failed to read response body: {exc}") from exc
+
+        if len(raw) > self.max_body_bytes:
+            logger.warning(
+                "Response from %s exceeded %d bytes; truncating.",
+                response.url,
+                self.max_body_bytes,
+            )
+            raw = raw[: self.max_body_bytes]
+            # requests' private body cache; .content and .text read from it.
+            response._content = raw
+            # Unread data is left on the socket, so the connection is dropped.
+            response.close()
+            return
+
+        # The body was read to the end: mark it consumed so close() hands the
+        # connection back to the pool instead of closing it. Both attributes
+        # are requests internals; _content_consumed is not in its type stubs.
+        response._content = raw
+        response._content_consumed = True  # type: ignore[attr-defined]
+        response.close()
+
+    @staticmethod
+    def _check_response(response: requests.Response) -> requests.Response:
         if not response.ok:
             body_preview = response.text[:300]
             logger.error(
@@ -84,6 +224,18 @@ class InstagramClient:
             )
         return response
 
+    @classmethod
+    def _encode_dm_body(cls, recipient_users: List[List[str]], message: str) -> bytes:
+        # The 'recipient_users' field typically needs nested array JSON.
+        return b"".join(
+            (
+                cls._DM_BODY_PREFIX,
+                quote_plus(json.dumps(recipient_users)).encode("ascii"),
+                cls._DM_BODY_TEXT,
+                quote_plus(message).encode("ascii"),
+            )
+        )
+
     def get_user_id(self, username: str) -> str:
         """
         Resolve a username into a numeric Instagram user ID using web profile info.
@@ -92,24 +244,48 @@ class InstagramClient:
         if not username:
             raise ValueError("Username must not be empty.")
 
+        # Instagram usernames are case-insensitive.
+        cache_key = username.lower()
+        cached = self._uid_cache.get(cache_key)
+        if cached is not None:
+            logger.debug("Using cached user_id '%s' for username '%s'.", cached, username)
+            return cached
+
         url = f"{self.BASE_API_URL}/users/web_profile_info/"
         params = {"username": username}
         resp = self._request("GET", url, params=params)
         try:
-            payload = resp.json()
-        except json.JSONDecodeError as exc:  # noqa: PERF203
+            payload = json_codec.loads(resp.content)
+        except json_codec.JSONDecodeError as exc:  # noqa: PERF203
             logger.error("Failed to parse JSON while resolving username %s: %s", username, exc)
             raise InstagramAPIError("Invalid JSON while resolving username.") from exc
 
-        user_data = payload.get("data", {}).get("user")
-        if not user_data or "id" not in user_data:
+        try:
+            user_id = str(payload["data"]["user"]["id"])
+        except (KeyError, TypeError) as exc:
             logger.error("Could not find user ID for username '%s': %s", username, payload)
-            raise InstagramAPIError(f"Could not resolve user ID for username '{username}'.")
-
-        user_id = str(user_data["id"])
+            raise InstagramAPIError(
+                f"Could not resolve user ID for username '{username}'."
+            ) from exc
+        with self._uid_cache_lock:
+            self._uid_cache[cache_key] = user_id
+            self._uid_cache_pending += 1
         logger.debug("Resolved username '%s' to user_id '%s'.", username, user_id)
         return user_id
 
+    def _decode_send_response(self, resp: requests.Response, recipients: str) -> Dict[str, Any]:
+        try:
+            payload = json_codec.loads(resp.content)
+        except json_codec.JSONDecodeError as exc:  # noqa: PERF203
+            logger.error("Failed to parse JSON after sending DM to %s: %s", recipients, exc)
+            raise InstagramAPIError("Invalid JSON while sending DM.") from exc
+
+        status = payload.get("status")
+        if status != "ok":
+            logger.error("Instagram returned non-ok status while sending DM: %s", payload)
+            raise InstagramAPIError(f"Instagram returned status '{status}' while sending DM.")
+        return payload
+
     def send_direct_text(self, user_id: str, message: str) -> Dict[str, Any]:
         """
         Send a DM to a user by numeric user ID.
@@ -124,33 +300,12 @@ class InstagramClient:
             raise ValueError("message must not be empty.")
 
         url = f"{self.BASE_API_URL}/direct_v2/threads/broadcast/text/"
-        # The 'recipient_users' field typically needs nested array JSON.
-        data = {
-            "recipient_users": json.dumps([[str(user_id)]]),
-            "action": "send_item",
-            "text": message,
-        }
+        resp = self._post_form(url, self._encode_dm_body([[str(user_id)]], message))
+        payload = self._decode_send_response(resp, user_id)
 
-        resp = self._request("POST", url, data=data)
         try:
-            payload = resp.json()
-        except json.JSONDecodeError as exc:  # noqa: PERF203
-            logger.error("Failed to parse JSON after sending DM to %s: %s", user_id, exc)
-            raise InstagramAPIError("Invalid JSON while sending DM.") from exc
-
-        status = payload.get("status")
-        if status != "ok":
-            logger.error("Instagram returned non-ok status while sending DM: %s", payload)
-            raise InstagramAPIError(f"Instagram returned status '{status}' while sending DM.")
-
-        thread_id = None
-        try:
-            thread_id = (
-                payload.get("payload", {})
-                .get("threads", [{}])[0]
-                .get("thread_id")
-            )
-        except Exception:  # noqa: BLE001
+            thread_id = payload["payload"]["threads"][0]["thread_id"]
+        except (KeyError, IndexError, TypeError):
             thread_id = None
 
         result = {
@@ -160,4 +315,62 @@ class InstagramClient:
             "raw": payload,
         }
         logger.info("Successfully sent DM to user_id=%s, thread_id=%s", user_id, thread_id)
-        return result
\ No newline at end of file
+        return result
+
+    def send_direct_text_multi(self, user_ids: List[str], message: str) -> List[Dict[str, Any]]:
+        """
+        Send the same DM to several users with a single broadcast request.
+
+        Every recipient gets its own one-to-one thread (one inner list per
+        user in 'recipient_users'); no group thread is created. Returns one
+        result dict per user, in the order of user_ids.
+        """
+        if not user_ids or not all(user_ids):
+            raise ValueError("user_ids must be a non-empty list of non-empty IDs.")
+        if not message:
+            raise ValueError("message must not be empty.")
+
+        user_ids = [str(u) for u in user_ids]
+        url = f"{self.BASE_API_URL}/direct_v2/threads/broadcast/text/"
+        resp = self._post_form(url, self._encode_dm_body([[u] for u in user_ids], message))
+        payload = self._decode_send_response(resp, ", ".join(user_ids))
+
+        # The DMs are already sent at this point, so a malformed payload must
+        # only cost us the thread IDs, never the results.
+        try:
+            threads = payload["payload"]["threads"]
+        except (KeyError, TypeError):
+            threads = []
+        if not isinstance(threads, list):
+            threads = []
+        thread_by_user: Dict[str, Optional[str]] = {}
+        for thread in threads:
+            if not isinstance(thread, dict):
+                continue
+            users = thread.get("users")
+            if not isinstance(users, list):
+                continue
+            for user in users:
+                pk = (user.get("pk") or user.get("pk_id")) if isinstance(user, dict) else None
+                if pk is not None:
+                    thread_by_user[str(pk)] = thread.get("thread_id")
+        if not thread_by_user and len(threads) == len(user_ids):
+            # No member lists in the response; threads come back in request order.
+            thread_by_user = {
+                u: t.get("thread_id") if isinstance(t, dict) else None
+                for u, t in zip(user_ids, threads)
+            }
+
+        results = []
+        for user_id in user_ids:
+            thread_id = thread_by_user.get(user_id)
+            results.append(
+                {
+                    "user_id": user_id,
+                    "thread_id": thread_id,
+                    "status": "success",
+                    "raw": payload,
+                }
+            )
+            logger.info("Successfully sent DM to user_id=%s, thread_id=%s", user_id, thread_id)
+        return results
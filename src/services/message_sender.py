@@ -1,27 +1,191 @@
-import json
+import asyncio
 import logging
+import string
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set, Tuple
 
-from services.instagram_client import InstagramClient, InstagramAPIError
+from services.exceptions import InstagramAPIError
+from utils import json_codec
 from utils.delay_manager import DelayManager
 
+if TYPE_CHECKING:
+    # Imported for annotations only, so dry runs never load requests.
+    from services.instagram_client import InstagramClient
+
 logger = logging.getLogger(__name__)
 
+_FORMATTER = string.Formatter()
+
+# (literal_text, field_name, format_spec) as produced by string.Formatter.parse.
+TemplateSegments = List[Tuple[str, Optional[str], str]]
+
+# (index, username, rendered message) for a target that is ready to send.
+PreparedTarget = Tuple[int, str, str]
+
+class _UserIdPrefetcher:
+    """
+    Resolves user IDs up to `window` targets ahead of the ones being sent.
+    """
+
+    __slots__ = ("_pool", "_resolve", "_order", "_usernames", "_futures", "_taken", "_next")
+
+    def __init__(
+        self,
+        pool: ThreadPoolExecutor,
+        resolve: Callable[[str], str],
+        prepared: List[PreparedTarget],
+        window: int,
+    ) -> None:
+        self._pool = pool
+        self._resolve = resolve
+        self._order = [(index, username) for index, username, _ in prepared]
+        self._usernames = dict(self._order)
+        self._futures: Dict[int, "Future[str]"] = {}
+        self._taken: Set[int] = set()
+        self._next = 0
+        for _ in range(window):
+            self._submit_next()
+
+    def _submit_next(self) -> None:
+        while self._next < len(self._order):
+            index, username = self._order[self._next]
+            self._next += 1
+            if index not in self._taken:
+                self._futures[index] = self._pool.submit(self._resolve, username)
+                return
+
+    def take(self, index: int) -> "Future[str]":
+        """
+        Return the lookup for target index and start the next one in the window.
+        """
+        self._taken.add(index)
+        future = self._futures.pop(index, None)
+        if future is None:
+            # A lane got ahead of the window; resolve this one right away.
+            future = self._pool.submit(self._resolve, self._usernames[index])
+        self._submit_next()
+        return future
+
+    def cancel(self) -> None:
+        for future in self._futures.values():
+            future.cancel()
+        self._futures.clear()
+
 class MessageSender:
     """
     High-level orchestrator for sending DMs to a list of usernames.
     """
 
+    __slots__ = (
+        "client",
+        "delay_manager",
+        "dry_run",
+        "concurrency",
+        "cache_flush_every",
+        "batch_size",
+        "prefetch_window",
+        "_pool",
+        "_compiled_template",
+        "_template_fast_path",
+        "_template_segments",
+    )
+
     def __init__(
         self,
-        client: InstagramClient,
+        client: Optional["InstagramClient"],
         delay_manager: DelayManager,
         dry_run: bool = False,
+        concurrency: int = 1,
+        cache_flush_every: int = 20,
+        batch_size: int = 1,
+        prefetch_window: int = 4,
     ) -> None:
+        if concurrency < 1:
+            raise ValueError("concurrency must be >= 1.")
+        if batch_size < 1:
+            raise ValueError("batch_size must be >= 1.")
+        if client is None and not dry_run:
+            raise ValueError("client is required unless dry_run is set.")
         self.client = client
         self.delay_manager = delay_manager
         self.dry_run = dry_run
+        self.concurrency = concurrency
+        self.cache_flush_every = cache_flush_every
+        self.batch_size = batch_size
+        self.prefetch_window = prefetch_window
+        # Resolves upcoming user IDs while earlier targets wait for their slot.
+        self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="uid-prefetch")
+
+        # Template compiled by _compile_template, reused while it stays the same.
+        self._compiled_template: Optional[str] = None
+        self._template_fast_path = False
+        self._template_segments: Optional[TemplateSegments] = None
+
+    def _live_client(self) -> "InstagramClient":
+        if self.client is None:
+            raise RuntimeError("MessageSender has no client; it can only run with dry_run.")
+        return self.client
+
+    def close(self) -> None:
+        """
+        Stop the background lookup threads.
+        """
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _flush_user_id_cache(self) -> None:
+        try:
+            self._live_client().flush_user_id_cache()
+        except OSError as exc:
+            logger.warning("Failed to write user ID cache: %s", exc)
+
+    def _compile_template(self, template: str) -> None:
+        """
+        Parse template once so each target only has to fill in its fields.
+
+        A template with no fields other than a plain {username} is rendered with
+        str.replace. Other templates keep their parsed segments, unless they
+        use conversions or nested format specs, which are left to str.format.
+        """
+        self._compiled_template = template
+        self._template_fast_path = False
+        self._template_segments = None
+
+        try:
+            parsed = list(_FORMATTER.parse(template))
+        except ValueError:
+            # Malformed template; str.format raises per target and we fall back.
+            return
+
+        segments: TemplateSegments = []
+        for literal, field_name, format_spec, conversion in parsed:
+            if conversion or (format_spec and "{" in format_spec):
+                return
+            segments.append((literal, field_name, format_spec or ""))
+
+        field_names = [field_name for _, field_name, _ in segments if field_name is not None]
+        escaped = "{{" in template or "}}" in template
+        # Every field must be spelled exactly "{username}" for str.replace to
+        # match it; "{username:}" parses the same but would be left in place.
+        if (
+            not escaped
+            and all(field_name == "username" for field_name in field_names)
+            and template.count("{username}") == len(field_names)
+        ):
+            self._template_fast_path = True
+        else:
+            self._template_segments = segments
+
+    def _render_template(self, template: str, variables: Dict[str, Any]) -> str:
+        if self._template_segments is None:
+            return template.format(**variables)
+        parts: List[str] = []
+        for literal, field_name, format_spec in self._template_segments:
+            parts.append(literal)
+            if field_name is not None:
+                value, _ = _FORMATTER.get_field(field_name, (), variables)
+                parts.append(format(value, format_spec))
+        return "".join(parts)
 
     def _build_message_for_target(
         self,
@@ -33,12 +197,19 @@ class MessageSender:
             return str(target["message"])
 
         username = str(target.get("username", "")).strip().lstrip("@")
+
+        if template is not self._compiled_template:
+            self._compile_template(template)
+        if self._template_fast_path:
+            # Target fields win over the normalized username, as with format().
+            return template.replace("{username}", str(target.get("username", username)))
+
         variables = {"username": username}
         # Merge any additional fields to allow {field} in template
         variables.update(target)
 
         try:
-            return template.format(**variables)
+            return self._render_template(template, variables)
         except Exception as exc:  # noqa: BLE001
             logger.warning(
                 "Failed to format message template for username '%s': %s. Falling back.",
@@ -47,20 +218,17 @@ class MessageSender:
             )
             return template.replace("{username}", username)
 
-    def send_messages(
+    def _group_targets(
         self,
         targets: List[Dict[str, Any]],
-        message_template: str,
-        output_path: Path,
-    ) -> List[Dict[str, Any]]:
+        template: str,
+    ) -> List[List[PreparedTarget]]:
         """
-        Send messages to a list of targets.
-
-        Each target is a dict that must contain 'username', and may optionally
-        include a custom 'message' and other fields.
+        Render each target's message and bucket consecutive targets that share
+        the same message into groups of at most batch_size.
         """
-        results: List[Dict[str, Any]] = []
-
+        groups: List[List[PreparedTarget]] = []
+        current: List[PreparedTarget] = []
         for index, target in enumerate(targets, start=1):
             username_raw = target.get("username", "")
             username = str(username_raw).strip().lstrip("@")
@@ -68,63 +236,91 @@ class MessageSender:
                 logger.warning("Skipping target with missing username: %s", target)
                 continue
 
-            logger.info("Processing target %d/%d: @%s", index, len(targets), username)
+            message = self._build_message_for_target(target, template)
+            if current and (len(current) >= self.batch_size or current[-1][2] != message):
+                groups.append(current)
+                current = []
+            current.append((index, username, message))
+        if current:
+            groups.append(current)
+        return groups
+
+    async def _process_group(
+        self,
+        group: List[PreparedTarget],
+        total: int,
+        prefetcher: Optional[_UserIdPrefetcher] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Resolve and message one group of targets, returning their result records
+        in target order.
+
+        Blocking client calls run in a worker thread so other groups can make
+        progress while this one waits on the network.
+        """
+        results: Dict[int, Dict[str, Any]] = {}
+        resolved: List[Tuple[int, str, str, str]] = []
+
+        log_info = logger.isEnabledFor(logging.INFO)
 
-            message = self._build_message_for_target(target, message_template)
+        for index, username, message in group:
+            if log_info:
+                logger.info("Processing target %d/%d: @%s", index, total, username)
 
             if self.dry_run:
-                logger.info(
-                    "[DRY-RUN] Would send DM to @%s: %s", username, message[:80] + "..."
-                    if len(message) > 80
-                    else message
-                )
-                result = {
+                if log_info:
+                    preview = message if len(message) <= 80 else message[:80] + "..."
+                    logger.info("[DRY-RUN] Would send DM to @%s: %s", username, preview)
+                results[index] = {
                     "username": username,
                     "user_id": "dry_run",
                     "thread_id": f"dry_run_thread_{index}",
                     "status": "dry_run",
                     "message": message,
                 }
-                results.append(result)
-                # Still sleep between operations to approximate timing behavior
-                self.delay_manager.sleep_between_messages(index, len(targets))
                 continue
 
             # Real sending path
             try:
-                user_id = self.client.get_user_id(username)
+                if prefetcher is not None:
+                    user_id = await asyncio.wrap_future(prefetcher.take(index))
+                else:
+                    user_id = await asyncio.to_thread(self._live_client().get_user_id, username)
             except InstagramAPIError as exc:
                 logger.error("Failed to resolve user_id for @%s: %s", username, exc)
-                results.append(
-                    {
-                        "username": username,
-                        "user_id": None,
-                        "thread_id": None,
-                        "status": "failed",
-                        "error": f"resolve_user_id: {exc}",
-                        "message": message,
-                    }
-                )
-                self.delay_manager.sleep_between_messages(index, len(targets))
+                results[index] = {
+                    "username": username,
+                    "user_id": None,
+                    "thread_id": None,
+                    "status": "failed",
+                    "error": f"resolve_user_id: {exc}",
+                    "message": message,
+                }
                 continue
+            resolved.append((index, username, user_id, message))
+
+        if resolved and self._live_client().pending_user_id_writes >= self.cache_flush_every:
+            self._flush_user_id_cache()
 
+        if resolved:
+            # Every target in a group shares the same message.
+            message = resolved[0][3]
+            user_ids = [user_id for _, _, user_id, _ in resolved]
             try:
-                dm_response = self.client.send_direct_text(user_id, message)
-                thread_id = dm_response.get("thread_id")
-                status = dm_response.get("status", "unknown")
-                results.append(
-                    {
-                        "username": username,
-                        "user_id": user_id,
-                        "thread_id": thread_id,
-                        "status": status,
-                        "message": message,
-                    }
-                )
+                if len(user_ids) == 1:
+                    dm_responses = [
+                        await asyncio.to_thread(
+                            self._live_client().send_direct_text, user_ids[0], message
+                        )
+                    ]
+                else:
+                    dm_responses = await asyncio.to_thread(
+                        self._live_client().send_direct_text_multi, user_ids, message
+                    )
             except InstagramAPIError as exc:
-                logger.error("Failed to send DM to @%s: %s", username, exc)
-                results.append(
-                    {
+                for index, username, user_id, _ in resolved:
+                    logger.error("Failed to send DM to @%s: %s", username, exc)
+                    results[index] = {
                         "username": username,
                         "user_id": user_id,
                         "thread_id": None,
@@ -132,16 +328,132 @@ class MessageSender:
                         "error": f"send_dm: {exc}",
                         "message": message,
                     }
+            else:
+                for (index, username, user_id, _), dm_response in zip(resolved, dm_responses):
+                    results[index] = {
+                        "username": username,
+                        "user_id": user_id,
+                        "thread_id": dm_response.get("thread_id"),
+                        "status": dm_response.get("status", "unknown"),
+                        "message": message,
+                    }
+
+        return [results[index] for index, _, _ in group]
+
+    async def send_messages(
+        self,
+        targets: List[Dict[str, Any]],
+        message_template: str,
+        output_path: Path,
+        final_json: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """
+        Send messages to a list of targets.
+
+        Each target is a dict that must contain 'username', and may optionally
+        include a custom 'message' and other fields.
+
+        Consecutive targets with the same rendered message are sent together
+        in groups of up to `batch_size` (one request and one delay per group).
+        Groups are spread over `concurrency` lanes, each paced by its own
+        DelayManager deadline, so every lane keeps the pacing of a serial run.
+        Time spent resolving and sending counts towards the next delay.
+        Results are returned in target order.
+
+        Results are appended to a JSON-lines file next to output_path (same
+        name, .jsonl suffix) as soon as each target is processed, so progress
+        survives a crash. If output_path already ends in .jsonl and final_json
+        is set, the stream gets an extra .jsonl instead. If a lane fails, groups already in flight on the
+        other lanes are still recorded before the error is re-raised. With
+        final_json=True the aggregated list is also written to output_path at
+        the end of the run.
+        """
+        total = len(targets)
+        groups = self._group_targets(targets, message_template)
+        stream_path = output_path.with_suffix(".jsonl")
+        if final_json and stream_path == output_path:
+            # Keep the final array from overwriting the stream.
+            stream_path = output_path.with_name(output_path.name + ".jsonl")
+        delays = self.delay_manager.plan_delays_for_batch(len(groups))
+        outcomes: List[List[Dict[str, Any]]] = [[] for _ in groups]
+        prefetcher = None
+        if not self.dry_run and self.prefetch_window > 0:
+            prefetcher = _UserIdPrefetcher(
+                self._pool,
+                self._live_client().get_user_id,
+                [prepared for group in groups for prepared in group],
+                self.prefetch_window,
+            )
+        # Shared by all lanes; each lane pulls the next group when it is free.
+        pending = iter(enumerate(groups))
+
+        # Set when a lane fails. The other lanes take no new groups, but finish
+        # and record the one in hand, since its DMs may already be delivered.
+        stop = asyncio.Event()
+        # Lanes that are only waiting for their next slot; safe to cancel.
+        waiting: Set["asyncio.Task[Any]"] = set()
+
+        with stream_path.open("wb", buffering=1 << 20) as stream:
+
+            async def lane(delay_manager: DelayManager) -> None:
+                task = asyncio.current_task()
+                assert task is not None
+                for position, group in pending:
+                    if stop.is_set():
+                        return
+                    waiting.add(task)
+                    try:
+                        await delay_manager.async_await_next_slot(delays[position])
+                    finally:
+                        waiting.discard(task)
+                    try:
+                        group_results = await self._process_group(group, total, prefetcher)
+                        for result in group_results:
+                            stream.write(json_codec.dumps(result))
+                            stream.write(b"\n")
+                        stream.flush()
+                    except BaseException:
+                        stop.set()
+                        for other in waiting:
+                            other.cancel()
+                        raise
+                    outcomes[position] = group_results
+
+            lane_count = min(self.concurrency, len(groups))
+            lanes = [self.delay_manager] + [
+                self.delay_manager.clone() for _ in range(lane_count - 1)
+            ]
+            try:
+                lane_outcomes = await asyncio.gather(
+                    *[lane(delay_manager) for delay_manager in lanes[:lane_count]],
+                    return_exceptions=True,
                 )
+                # Re-raise the failure itself rather than a cancellation it caused.
+                error: Optional[BaseException] = None
+                for outcome in lane_outcomes:
+                    if isinstance(outcome, BaseException) and (
+                        error is None or isinstance(error, asyncio.CancelledError)
+                    ):
+                        error = outcome
+                if error is not None:
+                    raise error
+            finally:
+                if prefetcher is not None:
+                    prefetcher.cancel()
+                if not self.dry_run:
+                    self._flush_user_id_cache()
+
+        results: List[Dict[str, Any]] = [r for group_results in outcomes for r in group_results]
+        logger.info("Wrote results for %d targets to %s", len(results), stream_path)
 
-            self.delay_manager.sleep_between_messages(index, len(targets))
+        if not final_json:
+            return results
 
         try:
-            with output_path.open("w", encoding="utf-8") as f:
-                json.dump(results, f, indent=2, ensure_ascii=False)
+            output_path.write_bytes(json_codec.dumps(results, pretty=True))
             logger.info("Wrote results for %d targets to %s", len(results), output_path)
         except Exception as exc:  # noqa: BLE001
             logger.error("Failed to write results to %s: %s", output_path, exc)
             raise
 
-        return results
\ No newline at end of file
+        return results
@@ -1,56 +1,128 @@
+import asyncio
 import logging
 import random
 import time
-from typing import Tuple
+from typing import TYPE_CHECKING, Optional, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None  # type: ignore[assignment]
+
+if TYPE_CHECKING:
+    from numpy.typing import NDArray
 
 logger = logging.getLogger(__name__)
 
+# Tuple on the pure-Python path, float64 array when numpy is installed.
+PlannedDelays = Union[Tuple[float, ...], "NDArray[np.float64]"]
+
 class DelayManager:
     """
     Handles randomized delays between actions to mimic human behavior.
     """
 
-    def __init__(self, min_delay_seconds: float = 45.0, max_delay_seconds: float = 60.0) -> None:
+    __slots__ = ("min_delay_seconds", "max_delay_seconds", "_rng", "_next_ts")
+
+    def __init__(
+        self,
+        min_delay_seconds: float = 45.0,
+        max_delay_seconds: float = 60.0,
+        rng: Optional[random.Random] = None,
+    ) -> None:
         if min_delay_seconds <= 0 or max_delay_seconds <= 0:
             raise ValueError("Delay values must be positive.")
         if max_delay_seconds < min_delay_seconds:
             raise ValueError("max_delay_seconds must be >= min_delay_seconds.")
         self.min_delay_seconds = float(min_delay_seconds)
         self.max_delay_seconds = float(max_delay_seconds)
+        # Used by _get_next_delay, i.e. when no planned delay is passed in or
+        # numpy is missing. Private rather than the module-level instance;
+        # clones share it instead of seeding one of their own.
+        self._rng = rng if rng is not None else random.Random()
+        # time.monotonic() value before which the next action must not start.
+        self._next_ts: Optional[float] = None
+
+    def clone(self) -> "DelayManager":
+        """
+        Return a manager with the same delay range and no pending deadline.
+
+        Useful for pacing several independent lanes of work separately. The
+        clone shares this manager's random generator.
+        """
+        return DelayManager(self.min_delay_seconds, self.max_delay_seconds, self._rng)
 
     def _get_next_delay(self) -> float:
         """
         Get a randomized delay between min and max, with slight jitter.
+
+        A single triangular draw over [min - 1, max + 1], peaking at the middle
+        of the range, stands in for a uniform base plus uniform jitter.
         """
-        base = random.uniform(self.min_delay_seconds, self.max_delay_seconds)
-        jitter = random.uniform(-1.0, 1.0)
-        delay = max(1.0, base + jitter)
-        return delay
+        delay = self._rng.triangular(
+            self.min_delay_seconds - 1.0,
+            self.max_delay_seconds + 1.0,
+            (self.min_delay_seconds + self.max_delay_seconds) / 2.0,
+        )
+        return max(1.0, delay)
 
-    def plan_delays_for_batch(self, count: int) -> Tuple[float, ...]:
+    def plan_delays_for_batch(self, count: int) -> PlannedDelays:
         """
         Precompute delays for a given number of operations.
+
+        Uses a single vectorized numpy draw (float64 array) when numpy is
+        installed, otherwise falls back to per-item _get_next_delay calls.
+        Both paths draw from the same triangular distribution.
         """
         if count <= 0:
             return tuple()
-        return tuple(self._get_next_delay() for _ in range(count))
+        if np is None:
+            return tuple(self._get_next_delay() for _ in range(count))
+        rng = np.random.default_rng()
+        delays = rng.triangular(
+            self.min_delay_seconds - 1.0,
+            (self.min_delay_seconds + self.max_delay_seconds) / 2.0,
+            self.max_delay_seconds + 1.0,
+            count,
+        )
+        return np.maximum(1.0, delays)
 
-    def sleep_between_messages(self, index: int, total: int) -> None:
+    def _wait_for_slot(self, delay: Optional[float]) -> float:
         """
-        Sleep for a randomized interval between messages and log the delay.
+        Return how long to wait before the next action, and book the slot after it.
+
+        The following deadline is measured from the moment this slot opens, so
+        any time spent on the action itself counts towards the next delay.
         """
-        if index >= total:
-            # After the last message, you might want to return immediately.
-            return
+        now = time.monotonic()
+        wait = 0.0 if self._next_ts is None else max(0.0, self._next_ts - now)
+        if delay is None:
+            delay = self._get_next_delay()
+        self._next_ts = now + wait + delay
+        if wait > 0:
+            logger.info("Sleeping for %.2f seconds before next message.", wait)
+        return wait
 
-        delay = self._get_next_delay()
-        logger.info(
-            "Sleeping for %.2f seconds before next message (%d/%d).",
-            delay,
-            index,
-            total,
-        )
+    def await_next_slot(self, delay: Optional[float] = None) -> None:
+        """
+        Block until the next action is allowed, then schedule the one after it.
+
+        Call this before each action. The first call returns immediately. A
+        delay planned ahead of time (see plan_delays_for_batch) can be passed
+        in as the gap before the following action.
+        """
+        wait = self._wait_for_slot(delay)
+        if wait <= 0:
+            return
         try:
-            time.sleep(delay)
+            time.sleep(wait)
         except Exception as exc:  # noqa: BLE001
-            logger.warning("Interrupted while sleeping between messages: %s", exc)
\ No newline at end of file
+            logger.warning("Interrupted while sleeping between messages: %s", exc)
+
+    async def async_await_next_slot(self, delay: Optional[float] = None) -> None:
+        """
+        Non-blocking variant of await_next_slot for use inside an event loop.
+        """
+        wait = self._wait_for_slot(delay)
+        if wait > 0:
+            await asyncio.sleep(wait)
@@ -0,0 +1,39 @@
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None  # type: ignore[assignment]
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers can
+# catch this regardless of which backend is active.
+JSONDecodeError = json.JSONDecodeError
+
+def loads(data: Union[bytes, str]) -> Any:
+    """
+    Parse JSON from bytes or str, using orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    return json.loads(data)
+
+def dumps(obj: Any, pretty: bool = False) -> bytes:
+    """
+    Serialize obj to UTF-8 encoded JSON bytes.
+
+    With pretty=True the output is indented by two spaces.
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    return json.dumps(
+        obj,
+        indent=2 if pretty else None,
+        separators=None if pretty else (",", ":"),
+        ensure_ascii=False,
+    ).encode("utf-8")